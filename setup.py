@@ -7,6 +7,7 @@ from setuptools import find_packages, setup
 
 MAIN_REQUIREMENTS = [
     "airbyte-cdk~=0.1",
+    "orjson~=3.8",
 ]
 
 TEST_REQUIREMENTS = [
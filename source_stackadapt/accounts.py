@@ -0,0 +1,414 @@
+#
+# Copyright (c) 2021 Airbyte, Inc., all rights reserved.
+#
+
+
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from hashlib import sha256
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from typing import IO, Any, Iterable, List, Mapping, MutableMapping, Optional, Tuple, Type, Union
+
+from airbyte_cdk.models import SyncMode
+from airbyte_cdk.sources.streams import Stream
+from airbyte_cdk.sources.streams.core import IncrementalMixin
+from airbyte_cdk.logger import AirbyteLogFormatter, AirbyteLogger
+
+from source_stackadapt.streams import StackadaptStream
+
+logger = AirbyteLogger()
+
+ACCOUNT_ID_FIELD = "account_id"
+# Keys of the state left by a single 'api_key' config, which can't be told apart from account IDs
+RESERVED_ACCOUNT_IDS = ("date", "advertisers", "slice_costs")
+# Environment variable the CDK reads the request cache directory from when a stream's session is created
+REQUEST_CACHE_PATH = "REQUEST_CACHE_PATH"
+
+
+@contextmanager
+def _account_request_cache(account_id: str):
+    """
+    Points the request cache of streams created in this context at a directory of the account's own.
+    The request cache key does not include headers, so accounts sharing a cache would read each other's
+    cached responses (e.g: another account's advertisers).
+
+    If the CDK entrypoint set a cache directory, the account's directory is created inside it so it is
+    reused by all streams of the account and removed with it at the end of the sync. Otherwise a temporary
+    directory is used for the duration of the context.
+    """
+    cache_path = os.environ.get(REQUEST_CACHE_PATH)
+    try:
+        if cache_path:
+            account_cache_path = os.path.join(cache_path, f"account_{sha256(account_id.encode()).hexdigest()[:16]}")
+            os.makedirs(account_cache_path, exist_ok=True)
+            os.environ[REQUEST_CACHE_PATH] = account_cache_path
+            yield
+        else:
+            with TemporaryDirectory(prefix="stackadapt_cache_") as account_cache_path:
+                os.environ[REQUEST_CACHE_PATH] = account_cache_path
+                yield
+    finally:
+        if cache_path:
+            os.environ[REQUEST_CACHE_PATH] = cache_path
+        else:
+            os.environ.pop(REQUEST_CACHE_PATH, None)
+
+
+def _init_worker():
+    """
+    Process pool initializer. Anything a worker process writes to stdout would be mixed into the Airbyte messages
+    of the parent process, so the worker's stdout is pointed at stderr. The logs of an account's read are captured by
+    '_read_account' and emitted by the parent process, so the log handlers inherited from the parent are removed.
+    """
+    os.dup2(2, 1)
+    logging.getLogger().handlers.clear()
+
+
+class _SpoolLogWriter(io.TextIOBase):
+    """
+    Stands in for stdout while an account is read, and writes each Airbyte LOG message printed to it to the
+    account's spool, so the parent process can emit them in order with the account's records.
+    Lines that are not Airbyte LOG messages are spooled as INFO logs. Writes from other threads are passed on to
+    the replaced stdout.
+    """
+
+    def __init__(self, spool: IO[str]):
+        self.spool = spool
+        self.stdout = sys.stdout
+        self.thread_id = threading.get_ident()
+        self._buffer = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if threading.get_ident() != self.thread_id:
+            return self.stdout.write(text)
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in filter(str.strip, lines):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            if isinstance(message, dict) and message.get("type") == "LOG":
+                log = message["log"]
+            else:
+                log = {"level": "INFO", "message": line}
+            self.spool.write(json.dumps({"log": log}))
+            self.spool.write("\n")
+        return len(text)
+
+
+class _SpoolLogHandler(logging.StreamHandler):
+    """
+    Log handler writing Airbyte LOG messages to a '_SpoolLogWriter', for streams logging through the logging module.
+    Only records logged by the writer's thread are handled.
+    """
+
+    def __init__(self, writer: _SpoolLogWriter):
+        super().__init__(writer)
+        self.setFormatter(AirbyteLogFormatter())
+        self.addFilter(lambda record: record.thread == writer.thread_id)
+
+
+def _remove_spool(future: Future):
+    """
+    Done callback removing the spool file of an account read whose records will never be returned.
+    """
+    if not future.cancelled() and not future.exception():
+        spool_path, _, _ = future.result()
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def _read_account(
+    stream_class: Type[StackadaptStream],
+    stream_kwargs: Mapping[str, Any],
+    account_id: str,
+    sync_mode: SyncMode,
+    cursor_field: Optional[List[str]],
+    stream_state: Optional[Mapping[str, Any]],
+) -> Tuple[str, Optional[Mapping[str, Any]], float]:
+    """
+    Runs in a worker process. Reads every slice of a single account's stream, tags each record with the
+    account ID and spools the records to a temporary JSON lines file so the parent process can stream them
+    back without holding a whole account in memory.
+    Logs of the read are spooled with the records, as {"log": {"level": ..., "message": ...}} lines, and records
+    as {"record": ...} lines.
+
+    :return a tuple of the spool file path, the stream state after the read (None for full refresh streams) and the
+            time the read took in seconds
+    """
+    read_started = time.monotonic()
+    with NamedTemporaryFile("w", prefix="stackadapt_", suffix=".jsonl", delete=False) as spool:
+        log_writer = _SpoolLogWriter(spool)
+        log_handler = _SpoolLogHandler(log_writer)
+        logging.getLogger().addHandler(log_handler)
+        try:
+            with _account_request_cache(account_id), redirect_stdout(log_writer):
+                stream = stream_class(**stream_kwargs)
+                is_incremental = isinstance(stream, IncrementalMixin)
+                if is_incremental and stream_state:
+                    stream.state = stream_state
+
+                for stream_slice in stream.stream_slices(sync_mode=sync_mode, cursor_field=cursor_field, stream_state=stream_state):
+                    for record in stream.read_records(
+                        sync_mode=sync_mode, cursor_field=cursor_field, stream_slice=stream_slice, stream_state=stream_state
+                    ):
+                        record = dict(record)
+                        record[ACCOUNT_ID_FIELD] = account_id
+                        spool.write(json.dumps({"record": record}))
+                        spool.write("\n")
+        except BaseException:
+            # Don't leave a partial spool behind if the read fails, but keep its logs on stderr
+            spool.close()
+            with open(spool.name) as partial_spool:
+                for line in partial_spool:
+                    log = json.loads(line).get("log")
+                    if log:
+                        print(f"{log['level']} {log['message']}", file=sys.stderr)
+            os.remove(spool.name)
+            raise
+        finally:
+            logging.getLogger().removeHandler(log_handler)
+
+    return spool.name, (stream.state if is_incremental else None), time.monotonic() - read_started
+
+
+class AccountShardedStream(Stream):
+    """
+    Wraps a StackAdapt stream so it can be read for several accounts (API keys) in one sync.
+
+    Each account is read in its own worker process, and all accounts are submitted to the process pool as soon as
+    slicing starts, most expensive first. There is one slice per account, and slices are returned in the order the
+    accounts are configured.
+    Records are tagged with the 'account_id' of the account they were read from, so the merged output is a single
+    ordered record stream.
+    """
+
+    def __init__(
+        self,
+        stream_class: Type[StackadaptStream],
+        accounts: List[Mapping[str, str]],
+        max_workers: Optional[int] = None,
+        **stream_kwargs,
+    ):
+        self.stream_class = stream_class
+        self.accounts = accounts
+        self.max_workers = min(max_workers or os.cpu_count() or 1, len(accounts))
+        self.stream_kwargs = stream_kwargs
+        # Instance of the wrapped stream used to expose its name, schema, keys and cursor
+        self.template_stream = stream_class(api_key=accounts[0]["api_key"], **stream_kwargs)
+        self._futures: MutableMapping[str, Future] = {}
+
+    @property
+    def name(self) -> str:
+        return self.template_stream.name
+
+    @property
+    def primary_key(self) -> Optional[Union[str, List[str], List[List[str]]]]:
+        """
+        IDs are only unique within an account, so the account ID is added to the wrapped stream's primary key.
+        """
+        primary_key = self.template_stream.primary_key
+        if not primary_key:
+            return None
+        if isinstance(primary_key, str):
+            primary_key = [[primary_key]]
+        elif isinstance(primary_key[0], str):
+            primary_key = [[key] for key in primary_key]
+        return [[ACCOUNT_ID_FIELD]] + primary_key
+
+    @property
+    def cursor_field(self) -> Union[str, List[str]]:
+        return self.template_stream.cursor_field
+
+    def get_json_schema(self) -> Mapping[str, Any]:
+        return self.template_stream.get_json_schema()
+
+    def _account_state(self, account_id: str) -> Optional[Mapping[str, Any]]:
+        """
+        Override to provide the state an account's read should resume from.
+        """
+        return None
+
+    def _account_cost(self, account_id: str) -> Optional[float]:
+        """
+        Override to provide the estimated cost of reading an account, used to submit the slowest accounts first.
+        None means the cost is unknown.
+        """
+        return None
+
+    def _account_priority(self, account_id: str) -> Tuple[bool, float]:
+        """
+        Sort key for submitting accounts. Accounts with an unknown cost come first, then the most expensive accounts.
+        """
+        cost = self._account_cost(account_id)
+        return cost is not None, -(cost or 0)
+
+    def _update_account_state(self, account_id: str, account_state: Optional[Mapping[str, Any]], read_time: float):
+        """
+        Override to keep the state returned by an account's read, and the time the read took.
+        """
+
+    def _discard_pending_reads(self):
+        """
+        Cancel account reads that have not started, and remove the spool files of the ones that will not be returned
+        as soon as they finish.
+        """
+        for future in self._futures.values():
+            if not future.cancel():
+                future.add_done_callback(_remove_spool)
+        self._futures.clear()
+
+    def stream_slices(
+        self, sync_mode: SyncMode, cursor_field: List[str] = None, stream_state: Mapping[str, Any] = None
+    ) -> Iterable[Optional[Mapping[str, Any]]]:
+        """
+        Submit a read for every account to the process pool and create one Stream Slice per account.
+        If the sync stops before every account has been returned, the remaining reads are discarded.
+        """
+        # Worker processes are forked with a copy of the stdout buffer, flush it so they don't write it again
+        sys.stdout.flush()
+        executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+        try:
+            for account in sorted(self.accounts, key=lambda account: self._account_priority(account["account_id"])):
+                account_id = account["account_id"]
+                self._futures[account_id] = executor.submit(
+                    _read_account,
+                    self.stream_class,
+                    {"api_key": account["api_key"], **self.stream_kwargs},
+                    account_id,
+                    sync_mode,
+                    cursor_field,
+                    self._account_state(account_id),
+                )
+            for account in self.accounts:
+                logger.info(f"Slice for {self.name} | Account ID: {account['account_id']}")
+                yield {ACCOUNT_ID_FIELD: account["account_id"]}
+        finally:
+            self._discard_pending_reads()
+            # Every returned account has been read already, so don't wait for discarded reads to finish
+            executor.shutdown(wait=False)
+
+    def read_records(
+        self,
+        sync_mode: SyncMode,
+        cursor_field: List[str] = None,
+        stream_slice: Mapping[str, Any] = None,
+        stream_state: Mapping[str, Any] = None,
+    ) -> Iterable[Mapping[str, Any]]:
+        """
+        Wait for the account's worker to finish, then stream its spooled records back and emit its logs.
+        """
+        account_id = stream_slice[ACCOUNT_ID_FIELD]
+        try:
+            spool_path, account_state, read_time = self._futures.pop(account_id).result()
+        except Exception:
+            logger.error(f"Failed to read {self.name} for Account ID: {account_id}")
+            self._discard_pending_reads()
+            raise
+        try:
+            with open(spool_path) as spool:
+                for line in spool:
+                    entry = json.loads(line)
+                    if "log" in entry:
+                        logger.log(entry["log"]["level"], entry["log"]["message"])
+                    else:
+                        yield entry["record"]
+        finally:
+            os.remove(spool_path)
+        self._update_account_state(account_id, account_state, read_time)
+
+
+class IncrementalAccountShardedStream(AccountShardedStream, IncrementalMixin):
+    """
+    Account sharded stream for incremental StackAdapt streams. State is kept per account, keyed by 'account_id',
+    and an account's state is only updated once all of its records have been returned. The time the account's last
+    read took is kept in its state under 'read_time', to submit the slowest accounts first.
+
+    State of accounts that are no longer configured is dropped. State left by a single 'api_key' config is migrated
+    to the account using the same API key ('legacy_account_id'), and ignored if there is no such account.
+    """
+
+    def __init__(
+        self,
+        stream_class: Type[StackadaptStream],
+        accounts: List[Mapping[str, str]],
+        legacy_account_id: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(stream_class, accounts, **kwargs)
+        self.legacy_account_id = legacy_account_id
+        self._account_states: MutableMapping[str, Mapping[str, Any]] = {}
+
+    @property
+    def state(self) -> Mapping[str, Any]:
+        return dict(self._account_states)
+
+    @state.setter
+    def state(self, value: Mapping[str, Any]):
+        account_ids = {account["account_id"] for account in self.accounts}
+        self._account_states = {account_id: state for account_id, state in value.items() if account_id in account_ids}
+
+        legacy_state = {key: state for key, state in value.items() if key not in account_ids}
+        if self.cursor_field not in legacy_state:
+            return
+        if self.legacy_account_id and self.legacy_account_id not in self._account_states:
+            logger.info(f"Migrating single account state of {self.name} to Account ID: {self.legacy_account_id}")
+            self._account_states[self.legacy_account_id] = legacy_state
+        else:
+            logger.info(f"Ignoring single account state of {self.name}, no account uses the same API key")
+
+    def _account_state(self, account_id: str) -> Optional[Mapping[str, Any]]:
+        return self._account_states.get(account_id)
+
+    def _account_cost(self, account_id: str) -> Optional[float]:
+        """
+        The estimated cost of an account is the time its read took in the last sync.
+        """
+        return self._account_states.get(account_id, {}).get("read_time")
+
+    def _update_account_state(self, account_id: str, account_state: Optional[Mapping[str, Any]], read_time: float):
+        if account_state:
+            self._account_states[account_id] = {**account_state, "read_time": round(read_time, 3)}
+
+
+def validate_accounts(accounts: List[Mapping[str, str]]):
+    """
+    Account IDs key the state of sharded streams, so they must be unique and must not be a key of single account state.
+
+    :raises ValueError: if an account ID is duplicated or reserved
+    """
+    account_ids = [account["account_id"] for account in accounts]
+    duplicate_ids = sorted({account_id for account_id in account_ids if account_ids.count(account_id) > 1})
+    if duplicate_ids:
+        raise ValueError(f"Account IDs must be unique, duplicated: {', '.join(duplicate_ids)}")
+    reserved_ids = [account_id for account_id in account_ids if account_id in RESERVED_ACCOUNT_IDS]
+    if reserved_ids:
+        raise ValueError(f"Account IDs can't be one of {', '.join(RESERVED_ACCOUNT_IDS)}, got: {', '.join(reserved_ids)}")
+
+
+def shard_by_account(
+    stream_class: Type[StackadaptStream],
+    accounts: List[Mapping[str, str]],
+    max_workers: Optional[int] = None,
+    legacy_account_id: Optional[str] = None,
+    **stream_kwargs,
+) -> AccountShardedStream:
+    """
+    Returns the account sharded wrapper matching the sync modes supported by the given stream class.
+    """
+    if issubclass(stream_class, IncrementalMixin):
+        return IncrementalAccountShardedStream(
+            stream_class, accounts, max_workers=max_workers, legacy_account_id=legacy_account_id, **stream_kwargs
+        )
+    return AccountShardedStream(stream_class, accounts, max_workers=max_workers, **stream_kwargs)
@@ -19,6 +19,7 @@ from source_stackadapt.streams import (
     AccountLineItemsStats,
     AccountNativeAdsStats
 )
+from source_stackadapt.accounts import shard_by_account, validate_accounts
 
 # Source
 class SourceStackadapt(AbstractSource):
@@ -31,16 +32,21 @@ class SourceStackadapt(AbstractSource):
         :return Tuple[bool, any]: (True, None) if the input config can be used to connect to the API successfully, (False, error) otherwise.
         """
         connection_url = "https://api.stackadapt.com/service/v2/campaigns"
-        headers = {
-            "X-Authorization": f"{config['api_key']}",
-            "Content-Type": "application/json"
-        }
         try:
-            response = requests.get(
-                url=connection_url,
-                headers=headers
-            )
-            response.raise_for_status()
+            # When multiple accounts are configured, every account's API key must be valid
+            if config.get("accounts"):
+                validate_accounts(config["accounts"])
+            api_keys = [account["api_key"] for account in config["accounts"]] if config.get("accounts") else [config["api_key"]]
+            for api_key in api_keys:
+                headers = {
+                    "X-Authorization": f"{api_key}",
+                    "Content-Type": "application/json"
+                }
+                response = requests.get(
+                    url=connection_url,
+                    headers=headers
+                )
+                response.raise_for_status()
             return True, None
         except Exception as e:
             return False, e
@@ -49,6 +55,8 @@ class SourceStackadapt(AbstractSource):
         """
         :param config: A Mapping of the user input configuration as defined in the connector spec.
         """
+        if config.get("accounts"):
+            return self._account_sharded_streams(config)
         return [
             Campaigns(api_key=config["api_key"]),
             LineItems(api_key=config["api_key"]),
@@ -57,14 +65,45 @@ class SourceStackadapt(AbstractSource):
             NativeAds(api_key=config["api_key"]),
             AccountCampaignsStats(
                 api_key=config["api_key"],
-                start_date=config.get("start_date"),
+                **self._stats_stream_kwargs(config),
             ),
             AccountLineItemsStats(
                 api_key=config["api_key"],
-                start_date=config.get("start_date"),
+                **self._stats_stream_kwargs(config),
             ),
             AccountNativeAdsStats(
                 api_key=config["api_key"],
-                start_date=config.get("start_date"),
+                **self._stats_stream_kwargs(config),
             )
         ]
+
+    def _account_sharded_streams(self, config: Mapping[str, Any]) -> List[Stream]:
+        """
+        Returns the same streams as a single account config, with each stream read for every configured
+        account in a process pool.
+        """
+        validate_accounts(config["accounts"])
+        # State of a connection that used a single 'api_key' is migrated to the account with the same API key
+        legacy_account_id = next(
+            (account["account_id"] for account in config["accounts"] if account["api_key"] == config.get("api_key")), None
+        )
+        sharding_kwargs = {"accounts": config["accounts"], "max_workers": config.get("max_workers")}
+        full_refresh_streams = [Campaigns, LineItems, Advertisers, ConversionTrackers, NativeAds]
+        stats_streams = [AccountCampaignsStats, AccountLineItemsStats, AccountNativeAdsStats]
+        return [
+            shard_by_account(stream_class, **sharding_kwargs) for stream_class in full_refresh_streams
+        ] + [
+            shard_by_account(stream_class, legacy_account_id=legacy_account_id, **self._stats_stream_kwargs(config), **sharding_kwargs)
+            for stream_class in stats_streams
+        ]
+
+    def _stats_stream_kwargs(self, config: Mapping[str, Any]) -> Mapping[str, Any]:
+        """
+        Returns the arguments shared by all delivery stats streams.
+        """
+        return {
+            "start_date": config.get("start_date"),
+            "prune_inactive_advertisers": config.get("prune_inactive_advertisers", False),
+            "inactive_advertiser_backoff": config.get("inactive_advertiser_backoff", 0),
+            "suppress_zero_rows": config.get("suppress_zero_rows", False),
+        }
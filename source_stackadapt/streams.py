@@ -6,8 +6,9 @@
 from abc import ABC
 from datetime import datetime, timedelta
 from math import ceil
-from typing import Any, Iterable, List, Mapping, MutableMapping, Optional
+from typing import Any, Iterable, List, Mapping, MutableMapping, Optional, Tuple
 
+import orjson
 import requests
 from airbyte_cdk.models import SyncMode
 from airbyte_cdk.sources.streams.core import IncrementalMixin
@@ -43,6 +44,17 @@ class StackadaptStream(HttpStream, ABC):
             "X-Authorization": self.api_key
         }
 
+    def decode_response(self, response: requests.Response) -> Mapping[str, Any]:
+        """
+        Decodes the JSON body of a response with orjson. The decoded body is kept on the response, so it is only
+        decoded once even though both next_page_token and parse_response need it.
+        """
+        decoded = vars(response).get("_decoded_json")
+        if decoded is None:
+            decoded = orjson.loads(response.content)
+            response._decoded_json = decoded
+        return decoded
+
     def next_page_token(self, response: requests.Response) -> Optional[Mapping[str, Any]]:
         """
         Determines if there are any more pages left to iterate through for request.
@@ -51,7 +63,7 @@ class StackadaptStream(HttpStream, ABC):
         :return If there is another page in the result, a mapping (e.g: dict) containing information needed to query the next page in the response.
                 If there are no more pages in the result, return None.
         """
-        response_body = response.json()
+        response_body = self.decode_response(response)
         
         # Determine if there are any more pages left
         current_page = response_body.get("page", 1)
@@ -84,7 +96,7 @@ class StackadaptStream(HttpStream, ABC):
         :return an iterable containing each record in the response
         """
 
-        response_json = response.json()
+        response_json = self.decode_response(response)
         yield from response_json.get("data", [])
 
 
@@ -98,6 +110,8 @@ class Campaigns(StackadaptStream):
     primary_key = "id"
     page_size = 30
     total_results_count_field = "total_campaigns"
+    # Use cache so that Stats streams can prune advertisers without making another API call
+    use_cache = True
 
     def path(
         self,
@@ -117,6 +131,8 @@ class LineItems(StackadaptStream):
     primary_key = "id"
     page_size = 30
     total_results_count_field = "total_line_items"
+    # Use cache so that Stats streams can prune advertisers without making another API call
+    use_cache = True
 
     def path(
         self,
@@ -195,13 +211,25 @@ class DeliveryStatStream(StackadaptStream):
     NOTE: Currently this stream only supports getting delivery stats at the 'Advertiser' level with additional granularity with the 'group_by_resource' argument.
     It will use the Advertisers stream to get stats for all advertiser IDs retrieved from the Advertiser stream. Substreams of this base stream can change the granularity
     by specifying the 'group_by_resource', 'date_range_type', and 'type' parameters.
+
+    If 'suppress_zero_rows' is set, rows where every metric field is zero or null are dropped. Metric fields are the
+    ACTIVITY_METRIC_FIELDS that are numeric in the stream's schema. Incremental streams move their cursor to the end of
+    each slice read, so the dates of dropped rows are not requested again.
     """
     # Constants
     DEFAULT_DATE_FORMAT = "%Y-%m-%d"
-
-    def __init__(self, start_date: str, **kwargs):
+    # Counts and spend that are zero for a row without any activity. Averages, rates and unit fields
+    # (e.g: 'atos_units', 'unique_imp_inverse_rate') are left out, as they are not guaranteed to be zero.
+    ACTIVITY_METRIC_FIELDS = (
+        "imp", "unique_imp", "click", "cost", "revenue", "profit", "tp_cpm_cost", "tp_cpc_cost", "page_start",
+        "conv", "conv_click", "conv_cookie", "conv_imp_derived", "conv_ip", "conv_rev", "s_conv", "unique_conv", "uniq_conv",
+    )
+
+    def __init__(self, start_date: str, suppress_zero_rows: bool = False, **kwargs):
         super().__init__(**kwargs)
         self.advertisers_stream = Advertisers(**kwargs)
+        self.suppress_zero_rows = suppress_zero_rows
+        self._metric_fields = None
         self.start_date = datetime.strptime(start_date, self.DEFAULT_DATE_FORMAT)
         self.end_date = datetime.utcnow() - timedelta(days=1)  # Only gets stats up until previous day. (Current day stats may be incomplete depending on when sync is ran)
     
@@ -245,6 +273,29 @@ class DeliveryStatStream(StackadaptStream):
         """
         return "all_time"
 
+    @property
+    def metric_fields(self) -> List[str]:
+        """
+        Activity metric fields that are numeric in the stream's schema. Used to find rows without any activity.
+        """
+        if self._metric_fields is None:
+            properties = self.get_json_schema()["properties"]
+            self._metric_fields = []
+            for field in self.ACTIVITY_METRIC_FIELDS:
+                field_type = properties.get(field, {}).get("type", [])
+                field_types = [field_type] if isinstance(field_type, str) else field_type
+                if {"integer", "number"} & set(field_types):
+                    self._metric_fields.append(field)
+        return self._metric_fields
+
+    def _is_zero_row(self, record: Mapping[str, Any]) -> bool:
+        """
+        Checks if a row has no activity. If the schema has none of the activity metric fields, no row is considered empty.
+        """
+        if not self.metric_fields:
+            return False
+        return not any(record.get(field) for field in self.metric_fields)
+
     def _get_stats_key(self):
         """
         Returns the key in which stats can be found in API response object if stat_type is 'total'.
@@ -333,7 +384,7 @@ class DeliveryStatStream(StackadaptStream):
         :return an iterable containing each record in the response
         """
 
-        stats_response = response.json()
+        stats_response = self.decode_response(response)
         stats_key = self._get_stats_key()
 
         # If stats type is 'total' stats will be nested in 'stats' object
@@ -347,7 +398,18 @@ class DeliveryStatStream(StackadaptStream):
             stats = stats_response["stats"]
         
         # Its possible for 'stats' to be None, if it is yield from empty list
-        yield from stats if stats else []
+        stats = stats if stats else []
+        if not self.suppress_zero_rows:
+            yield from stats
+            return
+
+        suppressed_count = 0
+        for record in stats:
+            if self._is_zero_row(record):
+                suppressed_count += 1
+                continue
+            yield record
+        logger.info(f"Suppressed {suppressed_count} of {len(stats)} zero activity rows for slice: {kwargs.get('stream_slice')}")
 
 
 class IncrementalDeliveryStatStream(DeliveryStatStream, IncrementalMixin):
@@ -356,25 +418,103 @@ class IncrementalDeliveryStatStream(DeliveryStatStream, IncrementalMixin):
     This stream incrementally loads stat by saving the latest 'date' seen
     in a record to state. It will then grab that date from state and only 
     request records newer than that date.
+
+    Advertisers without activity can be skipped to save requests:
+    - 'prune_inactive_advertisers' skips advertisers with no campaign or line item live in the slice's date range,
+      based on the start/end dates and state returned by the Campaigns and LineItems streams.
+    - 'inactive_advertiser_backoff' (N) skips advertisers whose last N syncs came back empty for N syncs, then checks
+      them again. The dates a skipped advertiser was not requested for are kept in state under 'advertisers' and
+      included in its next slice, so no stats are lost.
     """
 
     cursor_field = "date"
+    # Campaign and line item states that have never served, so can not have stats
+    NEVER_LIVE_STATES = ("draft",)
 
-    def __init__(self, start_date: str, **kwargs):
+    def __init__(self, start_date: str, prune_inactive_advertisers: bool = False, inactive_advertiser_backoff: int = 0, **kwargs):
         super().__init__(start_date, **kwargs)
+        self.campaigns_stream = Campaigns(api_key=self.api_key)
+        self.line_items_stream = LineItems(api_key=self.api_key)
+        self.prune_inactive_advertisers = prune_inactive_advertisers
+        self.inactive_advertiser_backoff = inactive_advertiser_backoff or 0
         self._cursor_value = None
+        self._advertiser_activity = {}
 
     @property
     def state(self) -> Mapping[str, Any]:
         if self._cursor_value:
-            return {self.cursor_field: self._cursor_value.strftime(self.DEFAULT_DATE_FORMAT)} 
+            state = {self.cursor_field: self._cursor_value.strftime(self.DEFAULT_DATE_FORMAT)}
         else:
-            return {self.cursor_field: self.start_date.strftime(self.DEFAULT_DATE_FORMAT)}
+            state = {self.cursor_field: self.start_date.strftime(self.DEFAULT_DATE_FORMAT)}
+        if self._advertiser_activity:
+            state["advertisers"] = self._advertiser_activity
+        return state
 
     @state.setter
     def state(self, value: Mapping[str, Any]):
         self._cursor_value = datetime.strptime(value[self.cursor_field], self.DEFAULT_DATE_FORMAT)
-    
+        self._advertiser_activity = {
+            advertiser_id: dict(activity) for advertiser_id, activity in value.get("advertisers", {}).items()
+        }
+
+    def _parse_date(self, value: Optional[str]) -> Optional[datetime]:
+        """
+        Campaign dates are returned as dates and line item dates as UTC timestamps, only the date part is used.
+        Returns None if the value is missing or can not be parsed.
+        """
+        try:
+            return datetime.strptime(value[:10], self.DEFAULT_DATE_FORMAT)
+        except (TypeError, ValueError):
+            return None
+
+    def _get_live_windows(self) -> Mapping[Any, List[Tuple[Optional[datetime], Optional[datetime]]]]:
+        """
+        Returns the (start_date, end_date) windows of every campaign and line item that could have served, by advertiser ID.
+        A missing date is treated as open ended.
+        """
+        live_windows = {}
+        for stream in (self.campaigns_stream, self.line_items_stream):
+            for record in stream.read_records(sync_mode=SyncMode.full_refresh):
+                if record.get("state") in self.NEVER_LIVE_STATES:
+                    continue
+                live_windows.setdefault(record.get("advertiser_id"), []).append(
+                    (self._parse_date(record.get("start_date")), self._parse_date(record.get("end_date")))
+                )
+        return live_windows
+
+    def _is_live(self, live_windows: Mapping[Any, List[Tuple[Optional[datetime], Optional[datetime]]]], advertiser_id: Any, slice_start_date: datetime) -> bool:
+        """
+        Checks if any of the advertiser's campaigns or line items was live between slice_start_date and end_date.
+        """
+        for window_start, window_end in live_windows.get(advertiser_id, []):
+            if (window_start is None or window_start <= self.end_date) and (window_end is None or window_end >= slice_start_date):
+                return True
+        return False
+
+    def _should_back_off(self, advertiser_id: Any, slice_start_date: datetime) -> bool:
+        """
+        Checks if an advertiser whose last N syncs came back empty should be skipped this sync.
+        Advertisers are skipped for N syncs, then checked again for all the dates they were skipped for.
+        """
+        activity = self._advertiser_activity.get(str(advertiser_id))
+        if not self.inactive_advertiser_backoff or not activity:
+            return False
+        if activity["empty_syncs"] < self.inactive_advertiser_backoff or activity["skipped_syncs"] >= self.inactive_advertiser_backoff:
+            return False
+        activity["skipped_syncs"] += 1
+        activity.setdefault("pending_start_date", slice_start_date.strftime(self.DEFAULT_DATE_FORMAT))
+        return True
+
+    def _record_advertiser_activity(self, advertiser_id: Any, record_count: int):
+        """
+        Keep count of consecutive empty syncs for an advertiser. Advertisers with stats are removed from the record.
+        """
+        if record_count:
+            self._advertiser_activity.pop(str(advertiser_id), None)
+        else:
+            activity = self._advertiser_activity.get(str(advertiser_id), {})
+            self._advertiser_activity[str(advertiser_id)] = {"empty_syncs": activity.get("empty_syncs", 0) + 1, "skipped_syncs": 0}
+
     def stream_slices(
         self, sync_mode: SyncMode,
         cursor_field: List[str] = None,
@@ -383,6 +523,7 @@ class IncrementalDeliveryStatStream(DeliveryStatStream, IncrementalMixin):
         """
         Override the stream slices method to update start_date from stream state
         """
+        live_windows = self._get_live_windows() if self.prune_inactive_advertisers else None
         for record in self.advertisers_stream.read_records(sync_mode=SyncMode.full_refresh):
             # Figure out start_date based on stream_state
             slice_start_date = self.start_date
@@ -391,13 +532,24 @@ class IncrementalDeliveryStatStream(DeliveryStatStream, IncrementalMixin):
                 slice_start_date = (
                     datetime.strptime(stream_state[self.cursor_field], self.DEFAULT_DATE_FORMAT) + timedelta(days=1)
                 )
-            if slice_start_date <= self.end_date:
-                logger.info(f"Slice for Advertiser ID: {record['id']} | Start Date: {slice_start_date} | End Date: {self.end_date}")
-                yield {
-                    "advertiser_id": record["id"],
-                    "start_date": slice_start_date.strftime(self.DEFAULT_DATE_FORMAT),
-                    "end_date": self.end_date.strftime(self.DEFAULT_DATE_FORMAT)
-                }
+            # Include the dates this advertiser was skipped for in previous syncs
+            pending_start_date = self._advertiser_activity.get(str(record["id"]), {}).get("pending_start_date")
+            if pending_start_date:
+                slice_start_date = min(slice_start_date, self._parse_date(pending_start_date))
+            if slice_start_date > self.end_date:
+                continue
+            if live_windows is not None and not self._is_live(live_windows, record["id"], slice_start_date):
+                logger.info(f"Skipping Advertiser ID: {record['id']} | No campaign or line item live between {slice_start_date} and {self.end_date}")
+                continue
+            if self._should_back_off(record["id"], slice_start_date):
+                logger.info(f"Skipping Advertiser ID: {record['id']} | Last syncs returned no stats")
+                continue
+            logger.info(f"Slice for Advertiser ID: {record['id']} | Start Date: {slice_start_date} | End Date: {self.end_date}")
+            yield {
+                "advertiser_id": record["id"],
+                "start_date": slice_start_date.strftime(self.DEFAULT_DATE_FORMAT),
+                "end_date": self.end_date.strftime(self.DEFAULT_DATE_FORMAT)
+            }
     
     def read_records(
         self,
@@ -406,14 +558,22 @@ class IncrementalDeliveryStatStream(DeliveryStatStream, IncrementalMixin):
         stream_slice: Mapping[str, Any] = None,
         stream_state: Mapping[str, Any] = None,
     ) -> Iterable[Mapping[str, Any]]:
+        record_count = 0
         for record in super().read_records(
             sync_mode=sync_mode, cursor_field=cursor_field, stream_slice=stream_slice, stream_state=stream_state
         ):
+            record_count += 1
             yield record
             # Update State with latest date 
             record_date = datetime.strptime(record[self.cursor_field], self.DEFAULT_DATE_FORMAT)
             stream_state_date = self._cursor_value if self._cursor_value else self.start_date
             self._cursor_value = max(stream_state_date, record_date)
+        if stream_slice and self.suppress_zero_rows:
+            # Suppressed rows don't move the cursor, so move it to the end of the slice or their dates would be requested again
+            slice_end_date = datetime.strptime(stream_slice["end_date"], self.DEFAULT_DATE_FORMAT)
+            self._cursor_value = max(self._cursor_value or self.start_date, slice_end_date)
+        if stream_slice and self.inactive_advertiser_backoff:
+            self._record_advertiser_activity(stream_slice["advertiser_id"], record_count)
     
 
 class AccountCampaignsStats(IncrementalDeliveryStatStream):
@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2021 Airbyte, Inc., all rights reserved.
+#
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+import urllib3
+from airbyte_cdk.models import SyncMode
+from source_stackadapt.accounts import (
+    AccountShardedStream,
+    IncrementalAccountShardedStream,
+    _read_account,
+    shard_by_account,
+    validate_accounts,
+)
+from source_stackadapt import streams
+from source_stackadapt.streams import AccountNativeAdsStats, Advertisers, Campaigns, DeliveryStatStream
+
+ACCOUNTS = [{"account_id": "a", "api_key": "key_a"}, {"account_id": "b", "api_key": "key_b"}]
+
+
+@pytest.fixture
+def thread_pool(mocker):
+    """
+    Read accounts in a thread, so mocks apply to the reads and no worker processes are started.
+    Reads change process wide state (environment, stdout), so a single thread is used, and the worker initializer
+    is not run as it would redirect the test process' stdout.
+    Returns the executors created, so tests can wait for discarded reads.
+    """
+    executors = []
+
+    def executor(max_workers=None, initializer=None):
+        executors.append(ThreadPoolExecutor(max_workers=1))
+        return executors[-1]
+
+    mocker.patch("source_stackadapt.accounts.ProcessPoolExecutor", side_effect=executor)
+    yield executors
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def stackadapt_api(mocker):
+    """
+    Mock the StackAdapt API below the request cache. Every account sees one advertiser and one campaign
+    with an ID depending on its API key, and delivery stats for the requested advertiser.
+    """
+    def send(adapter, request, **kwargs):
+        advertiser_id = {"key_a": 1, "key_b": 2}[request.headers["X-Authorization"]]
+        if "/advertisers" in request.url:
+            body = {"data": [{"id": advertiser_id}], "total_advertisers": 1}
+        elif "/delivery" in request.url:
+            body = {"stats": [{"date": "2022-01-02", "imp": 1, "advertiser_id": int(parse_qs(urlparse(request.url).query)["id"][0])}]}
+        elif "/line_items" in request.url:
+            body = {"data": [], "total_line_items": 0}
+        else:
+            body = {"data": [{"id": advertiser_id * 10, "advertiser_id": advertiser_id}], "total_campaigns": 1}
+        raw = urllib3.HTTPResponse(
+            body=io.BytesIO(json.dumps(body).encode()),
+            headers={"Content-Type": "application/json"},
+            status=200,
+            preload_content=False,
+            request_url=request.url,
+        )
+        return adapter.build_response(request, raw)
+
+    return mocker.patch.object(requests.adapters.HTTPAdapter, "send", autospec=True, side_effect=send)
+
+
+def read_sharded(stream, sync_mode=SyncMode.full_refresh):
+    records = []
+    for stream_slice in stream.stream_slices(sync_mode=sync_mode, stream_state=getattr(stream, "state", None)):
+        records.extend(stream.read_records(sync_mode=sync_mode, stream_slice=stream_slice))
+    return records
+
+
+def read_spool(spool_path):
+    with open(spool_path) as spool:
+        entries = [json.loads(line) for line in spool]
+    os.remove(spool_path)
+    return [entry["record"] for entry in entries if "record" in entry]
+
+
+def test_shard_by_account_class():
+    assert type(shard_by_account(Campaigns, ACCOUNTS)) is AccountShardedStream
+    assert type(shard_by_account(AccountNativeAdsStats, ACCOUNTS, start_date="2022-01-01")) is IncrementalAccountShardedStream
+
+
+def test_primary_key():
+    assert shard_by_account(Campaigns, ACCOUNTS).primary_key == [["account_id"], ["id"]]
+    assert shard_by_account(AccountNativeAdsStats, ACCOUNTS, start_date="2022-01-01").primary_key is None
+
+
+@pytest.mark.parametrize(
+    ("account_ids", "error"),
+    [
+        (["a", "b", "a"], "duplicated: a"),
+        (["a", "date"], "got: date"),
+        (["advertisers", "slice_costs"], "got: advertisers, slice_costs"),
+    ],
+)
+def test_validate_accounts(account_ids, error):
+    with pytest.raises(ValueError, match=error):
+        validate_accounts([{"account_id": account_id, "api_key": "key"} for account_id in account_ids])
+
+
+def test_validate_accounts_valid():
+    validate_accounts(ACCOUNTS)
+
+
+def test_output_in_account_order(thread_pool, mocker):
+    mocker.patch.object(Campaigns, "read_records", lambda self, **kwargs: iter([{"id": 1, "api_key": self.api_key}]))
+    accounts = [{"account_id": account_id, "api_key": f"key_{account_id}"} for account_id in "cab"]
+    records = read_sharded(shard_by_account(Campaigns, accounts, max_workers=3))
+    assert records == [
+        {"id": 1, "api_key": "key_c", "account_id": "c"},
+        {"id": 1, "api_key": "key_a", "account_id": "a"},
+        {"id": 1, "api_key": "key_b", "account_id": "b"},
+    ]
+
+
+def test_state_round_trip(thread_pool, mocker):
+    mocker.patch.object(AccountNativeAdsStats, "stream_slices", lambda self, **kwargs: [{"advertiser_id": 1, "end_date": "2022-01-05"}])
+    mocker.patch.object(DeliveryStatStream, "read_records", lambda self, stream_slice=None, **kwargs: iter([{"date": stream_slice["end_date"]}]))
+    stream = shard_by_account(AccountNativeAdsStats, ACCOUNTS, start_date="2022-01-01")
+    stream.state = {"a": {"date": "2022-01-02"}, "removed_account": {"date": "2022-01-02"}}
+    assert stream.state == {"a": {"date": "2022-01-02"}}
+
+    records = read_sharded(stream, SyncMode.incremental)
+    assert [record["account_id"] for record in records] == ["a", "b"]
+    assert {account_id: state["date"] for account_id, state in stream.state.items()} == {"a": "2022-01-05", "b": "2022-01-05"}
+
+
+@pytest.mark.parametrize(
+    ("legacy_account_id", "expected_state"),
+    [
+        ("b", {"a": {"date": "2022-01-03"}, "b": {"date": "2022-01-02"}}),
+        (None, {"a": {"date": "2022-01-03"}}),
+    ],
+)
+def test_single_account_state_migration(legacy_account_id, expected_state):
+    stream = shard_by_account(AccountNativeAdsStats, ACCOUNTS, legacy_account_id=legacy_account_id, start_date="2022-01-01")
+    stream.state = {"date": "2022-01-02", "a": {"date": "2022-01-03"}}
+    assert stream.state == expected_state
+
+
+def test_account_failure_removes_spools(thread_pool, mocker, tmp_path):
+    mocker.patch("source_stackadapt.accounts.NamedTemporaryFile", side_effect=lambda *args, **kwargs: open(
+        tmp_path / f"{len(os.listdir(tmp_path))}.jsonl", "w"
+    ))
+
+    def read_records(self, **kwargs):
+        if self.api_key == "key_a":
+            raise requests.HTTPError("Unauthorized")
+        yield {"id": 1}
+
+    mocker.patch.object(Campaigns, "read_records", read_records)
+    stream = shard_by_account(Campaigns, ACCOUNTS + [{"account_id": "c", "api_key": "key_c"}], max_workers=1)
+    with pytest.raises(requests.HTTPError):
+        read_sharded(stream)
+    thread_pool[0].shutdown(wait=True)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("request_cache_path", [True, False])
+def test_accounts_do_not_share_request_cache(stackadapt_api, monkeypatch, tmp_path, request_cache_path):
+    if request_cache_path:
+        monkeypatch.setenv("REQUEST_CACHE_PATH", str(tmp_path))
+    else:
+        monkeypatch.delenv("REQUEST_CACHE_PATH", raising=False)
+
+    # Read both accounts in the same process, as a single worker does
+    for account in ACCOUNTS:
+        spool_path, _, _ = _read_account(Advertisers, {"api_key": account["api_key"]}, account["account_id"], SyncMode.full_refresh, None, None)
+        records = read_spool(spool_path)
+        assert records == [{"id": {"key_a": 1, "key_b": 2}[account["api_key"]], "account_id": account["account_id"]}]
+    assert stackadapt_api.call_count == 2
+
+
+def test_accounts_do_not_share_request_cache_when_pruning(stackadapt_api, monkeypatch, tmp_path):
+    monkeypatch.setenv("REQUEST_CACHE_PATH", str(tmp_path))
+    stream_kwargs = {"start_date": "2022-01-01", "prune_inactive_advertisers": True}
+
+    for account in ACCOUNTS:
+        spool_path, _, _ = _read_account(
+            AccountNativeAdsStats, {"api_key": account["api_key"], **stream_kwargs}, account["account_id"], SyncMode.incremental, None, None
+        )
+        records = read_spool(spool_path)
+        advertiser_id = {"key_a": 1, "key_b": 2}[account["api_key"]]
+        assert records == [{"date": "2022-01-02", "imp": 1, "advertiser_id": advertiser_id, "account_id": account["account_id"]}]
+
+
+def test_account_submission_order(thread_pool, mocker, tmp_path):
+    read_order = []
+
+    def read_account(stream_class, stream_kwargs, account_id, *args):
+        read_order.append(account_id)
+        spool_path = tmp_path / f"{account_id}.jsonl"
+        spool_path.write_text(json.dumps({"record": {"date": "2022-01-02", "account_id": account_id}}) + "\n")
+        return str(spool_path), {"date": "2022-01-02"}, {"a": 1.0, "b": 2.0, "c": 3.0}[account_id]
+
+    mocker.patch("source_stackadapt.accounts._read_account", side_effect=read_account)
+    accounts = [{"account_id": account_id, "api_key": f"key_{account_id}"} for account_id in "abc"]
+    stream = shard_by_account(AccountNativeAdsStats, accounts, max_workers=1, start_date="2022-01-01")
+    stream.state = {"a": {"date": "2022-01-01", "read_time": 3.0}, "b": {"date": "2022-01-01", "read_time": 5.0}}
+    assert [stream._account_cost(account_id) for account_id in "abc"] == [3.0, 5.0, None]
+
+    records = read_sharded(stream, SyncMode.incremental)
+    # Accounts with an unknown cost are submitted first, then from most to least expensive
+    assert read_order == ["c", "b", "a"]
+    # Output is still in the configured account order
+    assert [record["account_id"] for record in records] == ["a", "b", "c"]
+    # The time of this sync's read replaces the last one
+    assert stream.state == {account_id: {"date": "2022-01-02", "read_time": read_time} for account_id, read_time in zip("abc", [1.0, 2.0, 3.0])}
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="Mocks only apply to forked worker processes")
+def test_worker_logs_emitted_in_order(mocker, capfd):
+    # Log to stdout as the CDK entrypoint does
+    mocker.patch.object(logging.getLogger(), "handlers", [logging.StreamHandler(sys.stdout)])
+
+    def read_records(self, **kwargs):
+        streams.logger.info(f"Reading {self.api_key}")
+        logging.getLogger("airbyte").warning(f"Read {self.api_key}")
+        yield {"id": 1}
+
+    mocker.patch.object(Campaigns, "read_records", read_records)
+    accounts = [{"account_id": account_id, "api_key": f"key_{account_id}"} for account_id in "abcd"]
+    records = read_sharded(shard_by_account(Campaigns, accounts, max_workers=2))
+    assert [record["account_id"] for record in records] == ["a", "b", "c", "d"]
+
+    # Worker logs are emitted by the parent process with their account's records, workers write nothing to stdout
+    stdout, _ = capfd.readouterr()
+    messages = [json.loads(line) for line in stdout.splitlines()]
+    assert [message["type"] for message in messages] == ["LOG"] * 12
+    assert [(message["log"]["level"], message["log"]["message"]) for message in messages] == [
+        log
+        for account_id in "abcd"
+        for log in [
+            ("INFO", f"Slice for campaigns | Account ID: {account_id}"),
+            ("INFO", f"Reading key_{account_id}"),
+            ("WARN", f"Read key_{account_id}"),
+        ]
+    ]
@@ -0,0 +1,32 @@
+#
+# Copyright (c) 2021 Airbyte, Inc., all rights reserved.
+#
+
+import json
+
+import orjson
+import requests
+from source_stackadapt import streams
+from source_stackadapt.streams import Campaigns
+
+
+def page_response(page, total_campaigns):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps({"data": [{"id": page}], "page": page, "total_campaigns": total_campaigns}).encode()
+    return response
+
+
+def test_decode_response_once(mocker):
+    orjson_mock = mocker.patch.object(streams, "orjson")
+    orjson_mock.loads.side_effect = orjson.loads
+    stream = Campaigns(api_key="key")
+    response = page_response(page=1, total_campaigns=45)
+
+    assert stream.next_page_token(response) == {"page": 2}
+    assert list(stream.parse_response(response)) == [{"id": 1}]
+    assert orjson_mock.loads.call_count == 1
+
+
+def test_next_page_token_last_page():
+    assert Campaigns(api_key="key").next_page_token(page_response(page=2, total_campaigns=45)) is None
@@ -0,0 +1,211 @@
+#
+# Copyright (c) 2021 Airbyte, Inc., all rights reserved.
+#
+
+import json
+from datetime import datetime
+
+import pytest
+import requests
+from airbyte_cdk.models import SyncMode
+from source_stackadapt import streams
+from source_stackadapt.streams import AccountCampaignsStats, AccountLineItemsStats, AccountNativeAdsStats, Advertisers, DeliveryStatStream
+
+END_DATE = datetime(2022, 1, 10)
+
+
+@pytest.fixture
+def stats_stream():
+    def create(**kwargs):
+        stream = AccountNativeAdsStats(api_key="key", start_date="2022-01-01", **kwargs)
+        stream.end_date = END_DATE
+        return stream
+
+    return create
+
+
+@pytest.fixture
+def advertisers(mocker):
+    return mocker.patch.object(Advertisers, "read_records", lambda self, **kwargs: iter([{"id": 1}, {"id": 2}]))
+
+
+def read_sync(stream, stream_state):
+    """
+    Read every slice of a sync starting from 'stream_state', as the CDK does. Returns the slices that were read.
+    """
+    if stream_state:
+        stream.state = stream_state
+    stream_slices = list(stream.stream_slices(sync_mode=SyncMode.incremental, stream_state=stream_state))
+    for stream_slice in stream_slices:
+        list(stream.read_records(sync_mode=SyncMode.incremental, stream_slice=stream_slice))
+    return stream_slices
+
+
+@pytest.mark.parametrize(
+    ("window", "slice_start_date", "is_live"),
+    [
+        (("2022-01-01", "2022-01-31"), datetime(2022, 1, 5), True),
+        (("2021-01-01", "2021-12-31"), datetime(2022, 1, 5), False),
+        (("2022-01-11", None), datetime(2022, 1, 5), False),
+        ((None, "2022-01-05"), datetime(2022, 1, 5), True),
+        ((None, None), datetime(2022, 1, 5), True),
+        (("2021-01-01", "2022-01-03"), datetime(2022, 1, 1), True),
+    ],
+)
+def test_is_live(stats_stream, window, slice_start_date, is_live):
+    stream = stats_stream()
+    live_windows = {1: [(stream._parse_date(window[0]), stream._parse_date(window[1]))]}
+    assert stream._is_live(live_windows, 1, slice_start_date) == is_live
+    assert not stream._is_live(live_windows, 2, slice_start_date)
+
+
+def test_get_live_windows_ignores_draft(stats_stream, mocker):
+    stream = stats_stream()
+    mocker.patch.object(
+        stream.campaigns_stream,
+        "read_records",
+        return_value=[
+            {"advertiser_id": 1, "state": "draft", "start_date": "2022-01-01"},
+            {"advertiser_id": 2, "state": "live", "start_date": "2022-01-01", "end_date": "2022-01-31T00:00:00Z"},
+        ],
+    )
+    mocker.patch.object(stream.line_items_stream, "read_records", return_value=[])
+    assert stream._get_live_windows() == {2: [(datetime(2022, 1, 1), datetime(2022, 1, 31))]}
+
+
+def test_record_advertiser_activity(stats_stream):
+    stream = stats_stream(inactive_advertiser_backoff=2)
+    stream._record_advertiser_activity(1, 0)
+    stream._record_advertiser_activity(1, 0)
+    assert stream._advertiser_activity == {"1": {"empty_syncs": 2, "skipped_syncs": 0}}
+    stream._record_advertiser_activity(1, 3)
+    assert stream._advertiser_activity == {}
+
+
+def test_should_back_off(stats_stream):
+    stream = stats_stream(inactive_advertiser_backoff=2)
+    stream._advertiser_activity = {"1": {"empty_syncs": 1, "skipped_syncs": 0}, "2": {"empty_syncs": 2, "skipped_syncs": 0}}
+    assert not stream._should_back_off(1, datetime(2022, 1, 5))
+    assert not stream._should_back_off(3, datetime(2022, 1, 5))
+
+    assert stream._should_back_off(2, datetime(2022, 1, 5))
+    assert stream._should_back_off(2, datetime(2022, 1, 8))
+    # The first skipped date is kept, so the next check covers every skipped date
+    assert stream._advertiser_activity["2"] == {"empty_syncs": 2, "skipped_syncs": 2, "pending_start_date": "2022-01-05"}
+    assert not stream._should_back_off(2, datetime(2022, 1, 10))
+
+
+def test_should_back_off_disabled(stats_stream):
+    stream = stats_stream()
+    stream._advertiser_activity = {"1": {"empty_syncs": 5, "skipped_syncs": 0}}
+    assert not stream._should_back_off(1, datetime(2022, 1, 5))
+
+
+def test_backoff_cycle(stats_stream, advertisers, mocker):
+    # Advertiser 1 always has stats, advertiser 2 never does
+    mocker.patch.object(
+        DeliveryStatStream,
+        "read_records",
+        lambda self, stream_slice=None, **kwargs: iter([{"date": stream_slice["end_date"]}] if stream_slice["advertiser_id"] == 1 else []),
+    )
+    state = None
+    synced_advertisers = []
+    for day in range(10, 17):
+        stream = stats_stream(inactive_advertiser_backoff=2)
+        stream.end_date = datetime(2022, 1, day)
+        synced_advertisers.append({stream_slice["advertiser_id"]: stream_slice["start_date"] for stream_slice in read_sync(stream, state)})
+        state = stream.state
+
+    assert synced_advertisers == [
+        {1: "2022-01-01", 2: "2022-01-01"},
+        {1: "2022-01-11", 2: "2022-01-11"},
+        # Advertiser 2 returned no stats for 2 syncs, it is skipped for 2 syncs
+        {1: "2022-01-12"},
+        {1: "2022-01-13"},
+        # then checked again for all the skipped dates
+        {1: "2022-01-14", 2: "2022-01-12"},
+        {1: "2022-01-15"},
+        {1: "2022-01-16"},
+    ]
+
+
+def test_prune_inactive_advertisers(stats_stream, advertisers, mocker):
+    stream = stats_stream(prune_inactive_advertisers=True)
+    mocker.patch.object(
+        stream.campaigns_stream,
+        "read_records",
+        return_value=[{"advertiser_id": 1, "start_date": "2021-01-01", "end_date": "2021-06-30"}],
+    )
+    mocker.patch.object(stream.line_items_stream, "read_records", return_value=[{"advertiser_id": 2, "start_date": "2022-01-09"}])
+    assert [stream_slice["advertiser_id"] for stream_slice in stream.stream_slices(sync_mode=SyncMode.incremental)] == [2]
+
+
+def stats_response(stats):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps({"stats": stats}).encode()
+    return response
+
+
+@pytest.mark.parametrize("stream_class", [AccountCampaignsStats, AccountLineItemsStats, AccountNativeAdsStats])
+def test_metric_fields(stream_class):
+    metric_fields = stream_class(api_key="key", start_date="2022-01-01").metric_fields
+    assert {"imp", "click", "cost"} <= set(metric_fields)
+    assert not {"atos_units", "page_time_units", "unique_imp_inverse_rate", "campaign_id", "date"} & set(metric_fields)
+
+
+def test_metric_fields_with_string_type(stats_stream, mocker):
+    stream = stats_stream()
+    mocker.patch.object(
+        AccountNativeAdsStats,
+        "get_json_schema",
+        return_value={"properties": {"imp": {"type": "integer"}, "click": {"type": ["null", "integer"]}, "cost": {"type": "string"}}},
+    )
+    assert stream.metric_fields == ["imp", "click"]
+
+
+@pytest.mark.parametrize(
+    ("suppress_zero_rows", "expected_dates"),
+    [
+        (True, ["2022-01-02", "2022-01-04"]),
+        (False, ["2022-01-01", "2022-01-02", "2022-01-03", "2022-01-04"]),
+    ],
+)
+def test_suppress_zero_rows(stats_stream, mocker, suppress_zero_rows, expected_dates):
+    logger_info = mocker.patch.object(streams.logger, "info")
+    stream = stats_stream(suppress_zero_rows=suppress_zero_rows)
+    response = stats_response(
+        [
+            {"date": "2022-01-01", "imp": 0, "click": 0, "cost": 0.0, "atos_units": 3, "native_ad_id": 5},
+            {"date": "2022-01-02", "imp": 10, "click": 0, "cost": 0.5},
+            {"date": "2022-01-03", "imp": None, "unique_imp_inverse_rate": 1.0},
+            {"date": "2022-01-04", "click": 1},
+        ]
+    )
+    records = list(stream.parse_response(response, stream_slice={"advertiser_id": 1}))
+    assert [record["date"] for record in records] == expected_dates
+    if suppress_zero_rows:
+        logger_info.assert_called_once_with("Suppressed 2 of 4 zero activity rows for slice: {'advertiser_id': 1}")
+    else:
+        logger_info.assert_not_called()
+
+
+def test_suppress_zero_rows_without_metric_fields(stats_stream, mocker):
+    stream = stats_stream(suppress_zero_rows=True)
+    mocker.patch.object(AccountNativeAdsStats, "get_json_schema", return_value={"properties": {"date": {"type": "string"}}})
+    records = list(stream.parse_response(stats_response([{"date": "2022-01-01"}, {"date": "2022-01-02", "imp": 0}]), stream_slice={}))
+    assert [record["date"] for record in records] == ["2022-01-01", "2022-01-02"]
+
+
+@pytest.mark.parametrize(("suppress_zero_rows", "expected_date"), [(True, "2022-01-10"), (False, "2022-01-04")])
+def test_suppress_zero_rows_cursor(stats_stream, mocker, suppress_zero_rows, expected_date):
+    # The last row has no activity
+    response = stats_response([{"date": "2022-01-03", "imp": 1}, {"date": "2022-01-04", "imp": 0}])
+    mocker.patch.object(
+        DeliveryStatStream, "read_records", lambda self, stream_slice=None, **kwargs: self.parse_response(response, stream_slice=stream_slice)
+    )
+    stream = stats_stream(suppress_zero_rows=suppress_zero_rows)
+    stream_slice = {"advertiser_id": 1, "start_date": "2022-01-01", "end_date": "2022-01-10"}
+    list(stream.read_records(sync_mode=SyncMode.incremental, stream_slice=stream_slice))
+    assert stream.state["date"] == expected_date
+
@@ -4,6 +4,8 @@
 
 from unittest.mock import MagicMock
 
+import pytest
+
 from source_stackadapt.source import SourceStackadapt
 
 
@@ -20,3 +22,18 @@ def test_streams(mocker):
     # TODO: replace this with your streams number
     expected_streams_number = 2
     assert len(streams) == expected_streams_number
+
+
+def test_check_connection_rejects_invalid_accounts(mocker):
+    requests_get = mocker.patch("source_stackadapt.source.requests.get")
+    config = {"accounts": [{"account_id": "a", "api_key": "key_a"}, {"account_id": "a", "api_key": "key_b"}]}
+    ok, error = SourceStackadapt().check_connection(MagicMock(), config)
+    assert not ok
+    assert isinstance(error, ValueError)
+    requests_get.assert_not_called()
+
+
+def test_streams_rejects_invalid_accounts():
+    config = {"accounts": [{"account_id": "date", "api_key": "key_a"}], "start_date": "2022-01-01"}
+    with pytest.raises(ValueError):
+        SourceStackadapt().streams(config)